@@ -1,19 +1,26 @@
 """
 Module for simulating a dynamic number of different MQTT clients, i.e. sensors and actuators.
-Each client is run in its own thread.
+All clients are driven by a single asyncio event loop, optionally partitioned across worker processes.
 """
 
 # pylint: disable=too-many-arguments, unused-argument
 
 from abc import abstractmethod
-import json
+import argparse
+import asyncio
+import heapq
+import itertools
 import logging
+import multiprocessing
+import os
 import random
-import threading
+import signal
+import sys
 import time
-import uuid
+import orjson
 from paho.mqtt.properties import Properties
 from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.subscribeoptions import SubscribeOptions
 import paho.mqtt.client as mqtt
 
 logger = logging.getLogger('mqtt_simulation')
@@ -24,187 +31,410 @@ logger.addHandler(ch)
 logger.setLevel("DEBUG")
 ch.setLevel("DEBUG")
 
+# Per-message log calls are gated on the level configured above
+_INFO = logger.info
+_INFO_ENABLED = logger.isEnabledFor(logging.INFO)
 
-def get_next_random(lower: int, upper: int) -> float:
+# JSON literals of False and True for the pre-formatted payloads, indexable by a bool
+JSON_BOOLEANS = (b"false", b"true")
+
+
+class AsyncioHelper():
     """
-    Function for getting a new random number with 'lower' and 'upper'
-    with two-digit precision.
+    Drives the network traffic of a paho.mqtt.client from an asyncio event loop
+    instead of a dedicated network thread (see paho's loop_asyncio example).
+    As there is no loop_start() thread reconnecting by itself, lost connections are
+    reestablished with an exponential backoff via reconnect().
     """
-    return round(random.uniform(lower, upper), 2)
+    reconnect_delay_min = 1
+    reconnect_delay_max = 120
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        self.reconnecting = None
+        self.reconnect_delay = self.reconnect_delay_min
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        """
+        Watches the opened socket for incoming data.
+        """
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        """
+        Stops watching the closed socket.
+        """
+        self.loop.remove_reader(sock)
+        if self.misc:
+            self.misc.cancel()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        """
+        Watches the socket for writability while paho has outgoing data.
+        """
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        """
+        Stops watching the socket for writability once paho's buffer is flushed.
+        """
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self):
+        """
+        Coroutine handling keepalive and retries of paho.mqtt.client.
+        """
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+    def schedule_reconnect(self):
+        """
+        Starts reconnecting in the background unless a reconnect is already pending.
+        """
+        if self.reconnecting is None or self.reconnecting.done():
+            self.reconnecting = self.loop.create_task(self.reconnect())
+
+    def cancel_reconnect(self):
+        """
+        Stops a pending reconnect, e.g. on shutdown.
+        """
+        if self.reconnecting:
+            self.reconnecting.cancel()
+
+    def reset_reconnect_delay(self):
+        """
+        Restarts the backoff once a connection has been accepted by the broker.
+        """
+        self.reconnect_delay = self.reconnect_delay_min
+
+    async def reconnect(self):
+        """
+        Coroutine reconnecting paho.mqtt.client, doubling the delay after every failed attempt.
+        """
+        while True:
+            delay = self.reconnect_delay
+            self.reconnect_delay = min(delay * 2, self.reconnect_delay_max)
+            logger.info("Reconnecting in %ds...", delay)
+            await asyncio.sleep(delay)
+            try:
+                self.client.reconnect()
+                return
+            except OSError as error:
+                logger.warning("Failed to reconnect: %s", error)
+
+
+_SHARED = mqtt.Client(protocol=mqtt.MQTTv5)
+_HANDLERS = {}
 
 
 class MQTTClient():
     """
     Abstract class for MQTT-based clients.
-    Handles basic callbacks, logging, and instantiation of paho.mqtt.client
+    All clients publish through a single shared paho.mqtt.client connection. This class handles
+    its basic callbacks, logging, and the dispatching of received messages by topic.
     """
+    __slots__ = ("name", "topic", "properties", "rng")
     broker_url = "192.168.21.105"
     broker_port = 1883
     main_topic = "mind2"
+    qos = 2
+    seed = None
+    helper = None
+    connected = None
+    disconnected = None
+    stopping = False
 
     @abstractmethod
     def __init__(self, topic: str, enable_detailed_logger=False):
         self.name = topic
-        self.client = mqtt.Client(client_id=self.name, protocol=mqtt.MQTTv5)
         self.topic = f"{self.main_topic}/{topic}"
-        self.client.on_connect = self.__on_connect
-        self.client.on_disconnect = self.__on_disconnect
-        self.client.on_publish = self.__on_publish
-        self.client.on_subscribe = self.__on_subscribe
-        self.client.on_unsubscribe = self.__on_unsubscribe
-        self.client.on_message = self.__on_message
+        self.properties = Properties(PacketTypes.PUBLISH)
+        # Own random stream per client, reproducible per client name if a seed is set
+        self.rng = random.Random() if self.seed is None else random.Random(f"{self.seed}/{self.name}")
 
         if enable_detailed_logger:
-            self.client.enable_logger(logger)
+            _SHARED.enable_logger(logger)
 
-    def connect(self):
+    @staticmethod
+    def connect():
         """
-        Helper function to connect to the MQTT-broker using paho.mqtt.client
+        Helper function to connect the shared paho.mqtt.client to the MQTT-broker on the running event loop
         """
-        self.client.connect(self.broker_url, self.broker_port, keepalive=60)
-
-    def publish(self, payload: str, correlation_data: None or str = None):
+        loop = asyncio.get_running_loop()
+        MQTTClient.helper = AsyncioHelper(loop, _SHARED)
+        MQTTClient.connected = loop.create_future()
+        MQTTClient.disconnected = loop.create_future()
+        _SHARED.on_connect = MQTTClient.__on_connect
+        _SHARED.on_disconnect = MQTTClient.__on_disconnect
+        _SHARED.on_publish = MQTTClient.__on_publish
+        _SHARED.on_subscribe = MQTTClient.__on_subscribe
+        _SHARED.on_unsubscribe = MQTTClient.__on_unsubscribe
+        _SHARED.on_message = MQTTClient.__on_message
+        _SHARED.connect(MQTTClient.broker_url, MQTTClient.broker_port, keepalive=60)
+
+    @staticmethod
+    def disconnect():
         """
-        Helper function to publish a message to a topic of the MQTT-broker using paho.mqtt.client
+        Helper function to unsubscribe all topics and disconnect the shared paho.mqtt.client from the MQTT-broker
         """
-        properties = Properties(PacketTypes.PUBLISH)
-        properties.CorrelationData = bytes(str(uuid.uuid1()), "utf-8") if not correlation_data else correlation_data
-        self.client.publish(self.topic, qos=2, payload=payload, properties=properties, retain=False)
-
-    def subscribe(self, topic):
+        MQTTClient.stopping = True
+        MQTTClient.helper.cancel_reconnect()
+        if _HANDLERS and _SHARED.is_connected():
+            _SHARED.unsubscribe(list(_HANDLERS))
+        if _SHARED.disconnect() == mqtt.MQTT_ERR_NO_CONN and not MQTTClient.disconnected.done():
+            # No socket left to close, e.g. while waiting for a reconnect
+            MQTTClient.disconnected.set_result(mqtt.MQTT_ERR_NO_CONN)
+
+    def publish(self, payload: bytes, correlation_data: None or bytes = None, qos: None or int = None):
+        """
+        Helper function to publish a message to a topic of the MQTT-broker using paho.mqtt.client.
+        Uses the QoS of the client class unless 'qos' is given. The payload is expected as
+        pre-encoded bytes, which paho.mqtt.client sends without converting it.
         """
-        Helper function to subscribe to a topic of the MQTT-broker using paho.mqtt.client
+        qos = self.qos if qos is None else qos
+        if qos == 0:
+            # QoS 0 messages are packed right away, so the properties of the client can be reused
+            properties = self.properties
+        else:
+            # paho.mqtt.client keeps queued QoS > 0 messages with their properties and packs them
+            # later (e.g. once in-flight slots free up or on reconnect), so each needs its own
+            properties = Properties(PacketTypes.PUBLISH)
+        properties.CorrelationData = os.urandom(16) if correlation_data is None else correlation_data
+        info = _SHARED.publish(self.topic, qos=qos, payload=payload, properties=properties, retain=False)
+        if info.rc == mqtt.MQTT_ERR_NO_CONN and _INFO_ENABLED:
+            # paho.mqtt.client drops QoS 0 messages while disconnected and sends others after reconnecting
+            _INFO("%s is not connected, message %s", self.name, "dropped" if qos == 0 else "queued")
+
+    @staticmethod
+    def subscribe(topics: list, qos=1):
         """
-        self.client.subscribe(topic, qos=2, options=None, properties=None)
+        Helper function to subscribe to a list of topics of the MQTT-broker using paho.mqtt.client.
+        All topics are sent in a single SUBSCRIBE packet.
+        """
+        options = SubscribeOptions(qos=qos)
+        _SHARED.subscribe([(topic, options) for topic in topics], properties=None)
 
-    def __on_publish(self, client, userdata, mid):
-        logger.info("%s published (Mid: %s)", self.name, mid)
+    @staticmethod
+    def __on_publish(client, userdata, mid):
+        if _INFO_ENABLED:
+            _INFO("Message published (Mid: %s)", mid)
 
-    def __on_connect(self, client, userdata, flags, response_code, properties):
+    @staticmethod
+    def __on_connect(client, userdata, flags, response_code, properties):
         if response_code == 0:
-            logger.info("\033[0;36m %s connected to %s:%s \033[0m", self.name, self.broker_url, self.broker_port)
+            logger.info("\033[0;36m Connected to %s:%s \033[0m", MQTTClient.broker_url, MQTTClient.broker_port)
+            MQTTClient.helper.reset_reconnect_delay()
+            # The session does not outlive the connection, so (re)subscribe all actuators on every connect
+            if _HANDLERS:
+                MQTTClient.subscribe(list(_HANDLERS))
+            if not MQTTClient.connected.done():
+                MQTTClient.connected.set_result(response_code)
         else:
-            logger.warning("Failed to connect, return code %d\n", response_code)
-
-    def __on_disconnect(self, client, userdata, flags, response_code):
-        logger.info("\033[0;36m %s disconnected from %s:%s \033[0m", self.name, self.broker_url, self.broker_port)
-
-    def __on_subscribe(self, client, userdata, mid, granted_qos, properties):
-        logger.info("%s subscribed '%s' with QoS %s (mid=%s)", self.name, self.topic, granted_qos[0], mid)
-
-    def __on_unsubscribe(self, client, userdata, mid, granted_qos, properties):
-        logger.info("%s unsubscribed from '%s'", self.name, self.topic)
-
-    def __on_message(self, client, userdata, message):
-        logger.info("%s received message: %s", self.name, message.payload.decode('utf-8'))
+            logger.warning("Failed to connect, return code %s", response_code)
+            if not MQTTClient.connected.done():
+                MQTTClient.connected.set_exception(ConnectionError(f"Connection refused by broker: {response_code}"))
+
+    @staticmethod
+    def __on_disconnect(client, userdata, response_code, properties):
+        logger.info("\033[0;36m Disconnected from %s:%s \033[0m", MQTTClient.broker_url, MQTTClient.broker_port)
+        if MQTTClient.stopping:
+            if not MQTTClient.disconnected.done():
+                MQTTClient.disconnected.set_result(response_code)
+        elif not MQTTClient.connected.done():
+            MQTTClient.connected.set_exception(ConnectionError(f"Connection lost before CONNACK: {response_code}"))
+        elif MQTTClient.connected.exception() is None:
+            # Only reconnect once the broker accepted the simulation, initial refusals end it
+            logger.warning("Lost connection to %s:%s (%s)", MQTTClient.broker_url, MQTTClient.broker_port, response_code)
+            MQTTClient.helper.schedule_reconnect()
+
+    @staticmethod
+    def __on_subscribe(client, userdata, mid, granted_qos, properties):
+        logger.info("Subscribed %d topics with QoS %s (mid=%s)", len(granted_qos), granted_qos[0], mid)
+
+    @staticmethod
+    def __on_unsubscribe(client, userdata, mid, granted_qos, properties):
+        logger.info("Unsubscribed (mid=%s)", mid)
+
+    @staticmethod
+    def __on_message(client, userdata, message):
+        handler = _HANDLERS.get(message.topic)
+        if handler:
+            handler(client, userdata, message)
+        else:
+            if _INFO_ENABLED:
+                _INFO("Received message on '%s': %s", message.topic, message.payload.decode('utf-8'))
 
 
 class MQTTSensor(MQTTClient):
     """
     Abstract class for a simple MQTT-based sensor based on the abstract MQTTClient class.
     The sensor publishes simulated status updates to a topic named after the sensor itself.
+    Status updates are periodic telemetry and published with QoS 0.
     """
+    __slots__ = ("__tick",)
+    qos = 0
+
     @abstractmethod
     def __init__(self, client_name: str, simulation):
         super().__init__(client_name)
-        self.connect()
-        self.client.loop_start()
         self.__tick = simulation
 
-    def loop(self):
+    def tick(self) -> int:
         """
-        Function to keep the sensor alive within its independent thread.
+        Function publishing the next simulated status update of the sensor.
+        Returns the delay in seconds until the sensor is due again.
         """
-        while SIMULATION_ALIVE:
-            self.__tick()
-        self.client.disconnect()
+        return self.__tick()
 
 
 class TemperatureSensor(MQTTSensor):
     """
     Object simulating an MQTT-based temperature sensor.
     """
+    __slots__ = ()
+    payload_format = b'{"temperature": %.2f, "humidity": %.2f, "battery": %.2f, "linkquality": %.2f}'
+
     def __init__(self, sensor_name: str):
         super().__init__(sensor_name, self.__simulation)
 
     def __simulation(self):
-        message = {
-            "temperature": get_next_random(18, 26),
-            "humidity": get_next_random(40, 90),
-            "battery": get_next_random(89, 92),
-            "linkquality": get_next_random(50, 255)}
-        self.publish(payload=json.dumps(message))
-        time.sleep(random.randint(10, 15))
+        # Uniform values are drawn inline, the payload template rounds them to two digits
+        rand = self.rng.random
+        self.publish(payload=self.payload_format % (
+            18 + rand() * 8,
+            40 + rand() * 50,
+            89 + rand() * 3,
+            50 + rand() * 205))
+        return self.rng.randint(10, 15)
 
 
 class MotionSensor(MQTTSensor):
     """
     Object simulating an MQTT-based motion sensor.
     """
+    __slots__ = ()
+    payload_format = b'{"on": true, "alert": %s, "battery": %.2f, "linkquality": %.2f}'
+
     def __init__(self, sensor_name: str):
         super().__init__(sensor_name, self.__simulation)
 
     def __simulation(self):
-        decision = [True, False, False, False, False, False, False, False]
-        message = {
-            "on": True,
-            "alert": decision[random.randint(0, len(decision)-1)],
-            "battery": get_next_random(89, 92),
-            "linkquality": get_next_random(50, 255)}
-        self.publish(payload=json.dumps(message))
-        time.sleep(random.randint(30, 60))
+        rand = self.rng.random
+        self.publish(payload=self.payload_format % (
+            JSON_BOOLEANS[rand() < 1 / 8],
+            89 + rand() * 3,
+            50 + rand() * 205))
+        return self.rng.randint(30, 60)
 
 
 class WindowSensor(MQTTSensor):
     """
     Object simulating an MQTT-based window sensor.
     """
+    __slots__ = ()
+    payload_format = b'{"open": %s, "battery": %.2f, "linkquality": %.2f}'
+
     def __init__(self, sensor_name: str):
         super().__init__(sensor_name, self.__simulation)
 
     def __simulation(self):
-        decision = [True, False, False, False, False, False, False, False]
-        message = {
-            "open": decision[random.randint(0, len(decision)-1)],
-            "battery": get_next_random(89, 92),
-            "linkquality": get_next_random(50, 255)}
-        self.publish(payload=json.dumps(message))
-        time.sleep(random.randint(100, 200))
+        rand = self.rng.random
+        self.publish(payload=self.payload_format % (
+            JSON_BOOLEANS[rand() < 1 / 8],
+            89 + rand() * 3,
+            50 + rand() * 205))
+        return self.rng.randint(100, 200)
 
 
 class DoorSensor(MQTTSensor):
     """
     Object simulating an MQTT-based door-opening sensor.
     """
+    __slots__ = ()
+    payload_format = b'{"open": %s, "battery": %.2f, "linkquality": %.2f}'
+
     def __init__(self, sensor_name: str):
         super().__init__(sensor_name, self.__simulation)
 
     def __simulation(self):
-        decision = [True, False, False, False, False, False, False, False]
-        message = {
-            "open": decision[random.randint(0, len(decision)-1)],
-            "battery": get_next_random(89, 92),
-            "linkquality": get_next_random(50, 255)}
-        self.publish(payload=json.dumps(message))
-        time.sleep(random.randint(100, 200))
+        rand = self.rng.random
+        self.publish(payload=self.payload_format % (
+            JSON_BOOLEANS[rand() < 1 / 8],
+            89 + rand() * 3,
+            50 + rand() * 205))
+        return self.rng.randint(100, 200)
 
 
 class SmokeDetector(MQTTSensor):
     """
     Object simulating an MQTT-based smoke detector.
     """
+    __slots__ = ()
+    payload_format = b'{"on": true, "alert": %s, "battery": %.2f, "linkquality": %.2f}'
+
     def __init__(self, sensor_name: str):
         super().__init__(sensor_name, self.__simulation)
 
     def __simulation(self):
-        decision = [True, False, False, False, False, False, False, False, False, False, False]
-        message = {
-            "on": True,
-            "alert": decision[random.randint(0, len(decision)-1)],
-            "battery": get_next_random(89, 92),
-            "linkquality": get_next_random(50, 255)}
-        self.publish(payload=json.dumps(message))
-        time.sleep(random.randint(100, 200))
+        rand = self.rng.random
+        self.publish(payload=self.payload_format % (
+            JSON_BOOLEANS[rand() < 1 / 11],
+            89 + rand() * 3,
+            50 + rand() * 205))
+        return self.rng.randint(100, 200)
+
+
+class Scheduler():
+    """
+    Object ticking all sensors from a single coroutine.
+    Pending ticks are kept in a heap ordered by their due time. A sensor whose tick fails
+    is logged and retried after 'retry_delay' seconds, without affecting the other sensors.
+    """
+    retry_delay = 10
+
+    def __init__(self):
+        self.queue = []
+        self.counter = itertools.count()
+
+    def schedule(self, delay: float, sensor: MQTTSensor, start: float = None):
+        """
+        Function scheduling the tick of 'sensor' 'delay' seconds after 'start' (default: now).
+        """
+        start = time.monotonic() if start is None else start
+        heapq.heappush(self.queue, (start + delay, next(self.counter), sensor))
+
+    async def run(self):
+        """
+        Coroutine calling all due ticks at once and rescheduling them with the delays they return.
+        Ticks rescheduled from the same batch share its start time, so sensors with equal delays
+        stay in the same batch instead of waking the event loop one by one.
+        """
+        queue = self.queue
+        while queue:
+            delay = queue[0][0] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.monotonic()
+            due = []
+            while queue and queue[0][0] <= now:
+                due.append(heapq.heappop(queue)[2])
+            for sensor in due:
+                try:
+                    delay = sensor.tick()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("%s failed to tick, retrying in %ss", sensor.name, self.retry_delay)
+                    delay = self.retry_delay
+                self.schedule(delay, sensor, now)
 
 
 class MQTTActuator(MQTTClient):
@@ -213,175 +443,248 @@ class MQTTActuator(MQTTClient):
     The actuator subscribes to a topic in the format 'actuator_name/toggleState' and
     simulate a reaction based on the messages posted in this topic. The reactions are published
     in the topic named after the actuator itself.
+    Commands are subscribed and reactions are published with QoS 1.
+    The simulation returns the reaction as a JSON prefix, which is formatted together with the status fields.
     """
+    __slots__ = ("simulation",)
+    qos = 1
+    payload_format = b'%s, "battery": %.2f, "linkquality": %.2f}'
 
     @abstractmethod
     def __init__(self, client_name: str, simulation):
         super().__init__(client_name)
-        self.client.on_connect = self.__on_connect
         self.simulation = simulation
-        self.client.on_message = self.__on_message
-        self.connect()
-        self.client.loop_start()
-
-    def __on_connect(self, client, userdata, flags, rc, properties):
-        if rc == 0:
-            logger.info("\033[0;36m %s connected to %s:%s \033[0m", self.name, self.broker_url, self.broker_port)
-            self.subscribe(f"{self.topic}/toggleState")
-        else:
-            logger.warning("Failed to connect, return code %d\n", rc)
+        _HANDLERS[f"{self.topic}/toggleState"] = self.__on_message
 
     def __on_message(self, client, userdata, message):
-        time.sleep(random.randint(1, 10)/1000)
-        in_message = json.loads(message.payload.decode("utf-8"))
-        logger.info("%s received message %s", self.name, in_message)
-        out_message = self.simulation(in_message)
-        out_message["battery"] = get_next_random(89, 92)
-        out_message["linkquality"] = get_next_random(50, 255)
-        self.publish(json.dumps(out_message), message.properties.CorrelationData)
+        asyncio.get_running_loop().call_later(self.rng.randint(1, 10)/1000, self.__react, message)
 
-    def loop(self):
-        """
-        Function for keeping the actuator alive within independent thread.
-        """
-        while SIMULATION_ALIVE:
-            time.sleep(0.1)
-        self.client.unsubscribe(self.topic)
-        self.client.disconnect()
+    def __react(self, message):
+        in_message = orjson.loads(message.payload)
+        if _INFO_ENABLED:
+            _INFO("%s received message %s", self.name, in_message)
+        rand = self.rng.random
+        payload = self.payload_format % (
+            self.simulation(in_message),
+            89 + rand() * 3,
+            50 + rand() * 205)
+        self.publish(payload, message.properties.CorrelationData)
 
 
 class DoorActuator(MQTTActuator):
     """
     Object simulating an MQTT-based door.
     """
+    __slots__ = ()
+
     def __init__(self, actuator_name: str):
         super().__init__(actuator_name, self.__simulation)
 
     def __simulation(self, message):
-        out_message = {"open": True}
-        out_message["open"] = message["open"]
-        return out_message
+        return b'{"open": %s' % JSON_BOOLEANS[bool(message["open"])]
 
 
 class Thermostat(MQTTActuator):
     """
     Object simulating an MQTT-based thermostat.
     """
+    __slots__ = ()
+
     def __init__(self, actuator_name: str):
         super().__init__(actuator_name, self.__simulation)
 
     def __simulation(self, message):
-        out_message = {"active": True, "state": 0}
-        out_message["active"] = message["active"]
-        if out_message["active"]:
-            out_message["state"] = message["state"]
-        return out_message
+        active = bool(message["active"])
+        # The state is echoed as received, whatever its JSON type
+        return b'{"active": %s, "state": %s' % (JSON_BOOLEANS[active], orjson.dumps(message["state"]) if active else b"0")
 
 
 class FireAlarm(MQTTActuator):
     """
     Object simulating an MQTT-based fire alarm.
     """
+    __slots__ = ()
+
     def __init__(self, actuator_name: str):
         super().__init__(actuator_name, self.__simulation)
 
     def __simulation(self, message):
-        out_message = {"alert": True}
-        out_message["alert"] = message["alert"]
-        return out_message
+        return b'{"alert": %s' % JSON_BOOLEANS[bool(message["alert"])]
 
 
 class Shutter(MQTTActuator):
     """
     Object simulating an MQTT-based shutter.
     """
+    __slots__ = ()
+
     def __init__(self, actuator_name: str):
         super().__init__(actuator_name, self.__simulation)
 
     def __simulation(self, message):
-        out_message = {"active": True, "percentage": 0}
-        out_message["active"] = message["active"]
-        if out_message["active"]:
-            out_message["percentage"] = message["percentage"]
-        return out_message
+        active = bool(message["active"])
+        # The percentage is echoed as received, whatever its JSON type
+        return b'{"active": %s, "percentage": %s' % (JSON_BOOLEANS[active], orjson.dumps(message["percentage"]) if active else b"0")
 
 
 class LedBulb(MQTTActuator):
     """
     Object simulating an MQTT-based led lightbulb.
     """
+    __slots__ = ()
+
     def __init__(self, actuator_name: str):
         super().__init__(actuator_name, self.__simulation)
 
     def __simulation(self, message):
-        out_message = {"on": True}
-        out_message["on"] = message["on"]
-        return out_message
-
+        return b'{"on": %s' % JSON_BOOLEANS[bool(message["on"])]
 
-if __name__ == "__main__":
-    SIMULATION_ALIVE = True
 
+def devices() -> list:
+    """
+    Function listing all simulated devices as (client class, client name) pairs.
+    """
     temperature_sensors = ["log_server", "belt_circulation", "cleaning_system", "pcs_server", "test_system1", "test_system2", "test_system3"]
     motion_sensors = ["log_server", "belt_circulation", "cleaning_system", "pcs_server", "test_system1", "test_system2", "test_system3"]
     window_sensors = ["log_server1", "log_server2", "log_server3", "cleaning_system1", "belt_circulation1", "belt_circulation2", "pcs_server"]
     door_sensors = ["main", "pcs_server"]
     smoke_detectors = ["log_server", "belt_circulation", "cleaning_system", "pcs_server"]
-    SENSORS_COUNT = len(temperature_sensors) + len(motion_sensors) + len(window_sensors) + len(door_sensors) + len(smoke_detectors)
 
     led_actuators = ["log_server1", "log_server2", "belt_circulation1", "belt_circulation2", "cleaning_system", "test_system1", "test_system2", "pcs_server"]
     firealarm_actuators = ["log_server", "belt_circulation", "cleaning_system", "pcs_server"]
     shutter_actuators = ["log_server1", "log_server2", "log_server3", "cleaning_system1", "belt_circulation1", "belt_circulation2", "pcs_server"]
     door_actuators = ["log_server", "belt_circulation", "cleaning_system", "pcs_server"]
     thermostat_actuators = ["log_server1", "log_server2", "log_server3", "cleaning_system", "belt_circulation1", "belt_circulation2", "pcs_server"]
-    ACTUATORS_COUNT = len(led_actuators) + len(firealarm_actuators) + len(shutter_actuators) + len(door_actuators) + len(thermostat_actuators)
 
-    logger.info("Starting simulation with %d sensors and %d actuators...", SENSORS_COUNT, ACTUATORS_COUNT)
+    device_list = []
 
     for sensor in temperature_sensors:
         name = f"{sensor}-sensor-temperature"
-        threading.Thread(name=name, target=TemperatureSensor(name).loop).start()
+        device_list.append((TemperatureSensor, name))
 
     for sensor in motion_sensors:
         name = f"{sensor}-sensor-motion"
-        threading.Thread(name=name, target=MotionSensor(name).loop).start()
+        device_list.append((MotionSensor, name))
 
     for sensor in window_sensors:
         name = f"{sensor}-sensor-window"
-        threading.Thread(name=name, target=WindowSensor(name).loop).start()
+        device_list.append((WindowSensor, name))
 
     for sensor in door_sensors:
         name = f"{sensor}-sensor-door"
-        threading.Thread(name=name, target=DoorSensor(name).loop).start()
+        device_list.append((DoorSensor, name))
 
     for sensor in smoke_detectors:
         name = f"{sensor}-sensor-smokedetector"
-        threading.Thread(name=name, target=SmokeDetector(name).loop).start()
+        device_list.append((SmokeDetector, name))
 
     for actuator in led_actuators:
         name = f"{actuator}-actuator-led"
-        threading.Thread(name=name, target=LedBulb(name).loop).start()
+        device_list.append((LedBulb, name))
 
     for actuator in firealarm_actuators:
         name = f"{actuator}-actuator-firealarm"
-        threading.Thread(name=name, target=FireAlarm(name).loop).start()
+        device_list.append((FireAlarm, name))
 
     for actuator in shutter_actuators:
         name = f"{actuator}-actuator-shutter"
-        threading.Thread(name=name, target=Shutter(name).loop).start()
+        device_list.append((Shutter, name))
 
     for actuator in door_actuators:
         name = f"{actuator}-actuator-door"
-        threading.Thread(name=name, target=DoorActuator(name).loop).start()
+        device_list.append((DoorActuator, name))
 
     for actuator in thermostat_actuators:
         name = f"{actuator}-actuator-thermostat"
-        threading.Thread(name=name, target=Thermostat(name).loop).start()
+        device_list.append((Thermostat, name))
+
+    return device_list
+
 
-    while SIMULATION_ALIVE:
+async def main(device_list: list, seed: None or str = None):
+    """
+    Instantiates the given devices, connects them to the MQTT-broker and keeps them alive until
+    SIGINT or SIGTERM is received.
+    """
+    MQTTClient.seed = seed
+    clients = [client_class(name) for client_class, name in device_list]
+
+    shutdown = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
         try:
-            time.sleep(.1)
-        except KeyboardInterrupt:
-            SIMULATION_ALIVE = False
+            asyncio.get_running_loop().add_signal_handler(signum, shutdown.set)
+        except NotImplementedError:
+            # Not available on Windows, where Ctrl-C cancels this coroutine instead
+            pass
+
+    scheduler = Scheduler()
+    for client in clients:
+        if isinstance(client, MQTTSensor):
+            scheduler.schedule(0, client)
+
+    MQTTClient.connect()
+    stopping = asyncio.ensure_future(shutdown.wait())
+    ticking = None
+    try:
+        # Shutdown may be requested before the broker answers, or instead of it
+        await asyncio.wait([MQTTClient.connected, stopping], return_when=asyncio.FIRST_COMPLETED)
+        if not shutdown.is_set():
+            MQTTClient.connected.result()
+            ticking = asyncio.create_task(scheduler.run())
+            await stopping
+    finally:
+        stopping.cancel()
+        if ticking:
+            ticking.cancel()
+        logger.info("Unsubscribing and disconnecting clients. This may take a while...")
+        MQTTClient.disconnect()
+        await asyncio.wait([MQTTClient.disconnected], timeout=10)
+
+
+def run_worker(device_list: list, seed: None or str = None):
+    """
+    Function running the simulation of the given devices on an event loop of its own.
+    """
+    if sys.platform == "win32":
+        # The default proactor event loop does not support watching sockets via add_reader/add_writer
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    try:
+        asyncio.run(main(device_list, seed))
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        logger.error("Simulation stopped: %s", error)
+        sys.exit(1)
+
 
-    logger.info("Unsubscribing and disconnecting clients. This may take a while...")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the devices are partitioned across, each with its own broker connection")
+    parser.add_argument("--seed",
+                        help="seed for reproducible simulations, each device derives its own random stream from it")
+    args = parser.parse_args()
+
+    all_devices = devices()
+    sensors_count = sum(issubclass(client_class, MQTTSensor) for client_class, _ in all_devices)
+    actuators_count = len(all_devices) - sensors_count
+    logger.info("Starting simulation with %d sensors and %d actuators...", sensors_count, actuators_count)
+
+    if args.workers <= 1:
+        run_worker(all_devices, args.seed)
+    else:
+        workers = [multiprocessing.Process(name=f"worker-{i}", target=run_worker, args=(all_devices[i::args.workers], args.seed))
+                   for i in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+        if any(worker.exitcode for worker in workers):
+            sys.exit(1)